@@ -1,119 +1,553 @@
 
+import asyncio
+import codecs
+import functools
+import hashlib
+import io
+import json
 import subprocess
 import sys
 import os
 import re
+import time
 import google.generativeai as genai
 
 # --- Configuration ---
 # Fetch the API key from environment variables
 GEMINI_API_KEY = os.getenv("GEMINI_API_KEY")
-if GEMINI_API_KEY:
-    genai.configure(api_key=GEMINI_API_KEY)
+
+# Matches the header block of each file in a unified diff: the "diff --git" line, any
+# extended header lines, then either "rename to <path>" or the "--- a/path"/"+++ b/path"
+# pair. Empty, binary and mode-only changes have neither, so that part is optional and
+# the path then comes from the "diff --git" line itself. Anchoring on "diff --git" keeps
+# hunk lines such as "-- a/x" from matching, and git appends a tab to names containing
+# spaces, which is left out of the captured path.
+_DIFF_FILE_RE = re.compile(
+    rb'^diff --git ([^\n]*)\n'
+    rb'(?:(?!--- |rename to |diff --git )[^\n]*\n)*'
+    rb'(?:rename to ([^\n]*)|--- ([^\t\n]*)\t?\n\+\+\+ ([^\t\n]*))?',
+    re.MULTILINE
+)
+
+# Directories left out of the file tree as noise.
+_IGNORE_DIRS = frozenset({'.git', 'node_modules', '__pycache__', 'dist', 'build'})
+
+# Only changed files with these extensions are previewed; lockfiles and minified bundles are skipped.
+# File size is not checked: get_file_preview reads a bounded prefix of the blob (or file) whatever its size.
+_TEXT_EXTS = frozenset({
+    '.py', '.ts', '.tsx', '.js', '.jsx', '.mjs', '.cjs', '.go', '.rs', '.java',
+    '.c', '.cc', '.cpp', '.h', '.md', '.txt', '.yml', '.yaml', '.toml', '.json',
+})
+_SKIPPED_FILES = frozenset({
+    'package-lock.json', 'npm-shrinkwrap.json', 'yarn.lock', 'pnpm-lock.yaml', 'bun.lockb',
+    'poetry.lock', 'Pipfile.lock', 'uv.lock', 'Cargo.lock', 'composer.lock', 'Gemfile.lock',
+    'go.sum', 'flake.lock',
+})
+
+# Upper bounds (in characters; bytes for the raw diff) for the larger context sections of the prompt.
+# Prompt size drives both API cost and latency, so huge trees/diffs are trimmed.
+MAX_FILE_TREE_CHARS = 20_000
+MAX_DIFF_CHARS = 40_000
+MAX_CHANGED_FILES_CHARS = 20_000
+
+# Longest diff header line worth keeping while waiting for the rest of it to arrive.
+_MAX_HEADER_LINE = 4096
+
+# Splits a diff into per-file sections, keeping each "diff --git" header.
+_DIFF_SPLIT_RE = re.compile(rb'^(?=diff --git )', re.MULTILINE)
+
+# The file tree and commit log are cached here between runs, keyed by HEAD and the index mtime.
+CACHE_DIR = os.path.join(os.path.expanduser("~"), ".cache", "criticize")
+CACHE_MAX_AGE_SECONDS = 24 * 60 * 60
 
 # --- Context Gathering Functions ---
 
-def run_command(command):
-    """A helper function to run shell commands and return the output."""
+def _command_error(command, error):
+    """Formats a failed command, given its stderr bytes or the exception it raised, as a message."""
+    if isinstance(error, FileNotFoundError):
+        return f"Error: Command '{command[0]}' not found. Is it installed and in your PATH?"
+    if isinstance(error, Exception):
+        return f"An unexpected error occurred: {error}"
+    return f"Error running command '{' '.join(command)}':\n{error.decode('utf-8', errors='replace')}"
+
+async def run_command_async(command, none_on_error=False):
+    """
+    A helper function to run shell commands asynchronously and return the output.
+    With none_on_error=True a failure returns None instead of an error message.
+    """
     try:
-        result = subprocess.run(
-            command,
-            capture_output=True,
-            text=True,
-            check=False
+        proc = await asyncio.create_subprocess_exec(
+            *command,
+            stdout=asyncio.subprocess.PIPE,
+            stderr=asyncio.subprocess.PIPE
         )
-        if result.returncode != 0:
-            return f"Error running command '{' '.join(command)}':\n{result.stderr}"
-        return result.stdout
-    except FileNotFoundError:
-        return f"Error: Command '{command[0]}' not found. Is it installed and in your PATH?"
+        stdout, stderr = await proc.communicate()
+        if proc.returncode != 0:
+            return None if none_on_error else _command_error(command, stderr)
+        return stdout.decode('utf-8', errors='replace')
     except Exception as e:
-        return f"An unexpected error occurred: {e}"
+        return None if none_on_error else _command_error(command, e)
 
 
-def get_staged_diff_with_context():
+async def get_staged_diff_with_context():
     """
     Retrieves the staged changes from Git with a larger context window for better analysis.
     -U10 provides 10 lines of context around each change.
+    The diff is streamed from git and scanned for changed files while it is still being written.
+    Returns (raw diff bytes, {changed file path: deleted}); on failure the first item is an error message.
     """
-    return run_command(['git', 'diff', '--staged', '-U10'])
+    # Fixed a/ b/ prefixes and unquoted non-ASCII names keep the headers easy to parse
+    command = [
+        'git', '--no-pager', '-c', 'core.quotePath=false',
+        'diff', '--staged', '-U10', '--src-prefix=a/', '--dst-prefix=b/'
+    ]
+    try:
+        proc = await asyncio.create_subprocess_exec(
+            *command,
+            stdout=asyncio.subprocess.PIPE,
+            stderr=asyncio.subprocess.PIPE
+        )
+        try:
+            chunks = []
+            changed_files = {}
+            pending = b""
+            while True:
+                chunk = await proc.stdout.read(65536)
+                if not chunk:
+                    break
+                chunks.append(chunk)
+                buf = pending + chunk if pending else chunk
+                # Scan in place up to the last point where no file header block is cut off;
+                # the rest is carried into the next read
+                end = _diff_scan_end(buf)
+                changed_files.update(parse_diff_for_changed_files(buf, 0, end))
+                # A very long unfinished line (e.g. a minified bundle) cannot be a header,
+                # so only its start is carried; this keeps `pending` from growing on every read
+                last_line = buf.rfind(b"\n") + 1
+                pending = buf[end:last_line] + buf[last_line:last_line + _MAX_HEADER_LINE]
+            changed_files.update(parse_diff_for_changed_files(pending))
+            stderr = await proc.stderr.read()
+            if await proc.wait() != 0:
+                return _command_error(command, stderr), {}
+            return b"".join(chunks), changed_files
+        finally:
+            # Don't leave git running if reading its output failed or was cancelled
+            if proc.returncode is None:
+                proc.kill()
+                await proc.wait()
+    except Exception as e:
+        return _command_error(command, e), {}
 
-def get_git_log_subjects():
+async def get_git_log_subjects():
     """
     Retrieves the subjects of the last 15 commits to understand recent project velocity.
     """
-    return run_command(['git', 'log', '-n', '15', '--pretty=format:"%s"'])
+    return await run_command_async(['git', 'log', '-n', '15', '--pretty=format:"%s"'])
 
-def get_file_tree():
+def _diff_scan_end(buf):
+    """
+    Returns how much of a partially received diff can be scanned for file headers:
+    everything up to the last complete line, minus a trailing file header block
+    that has not reached its "+++"/"rename to" line yet.
+    """
+    end = buf.rfind(b"\n") + 1
+    header = buf.rfind(b"\ndiff --git ", 0, end) + 1
+    if not header and not buf.startswith(b"diff --git "):
+        return end
+    if buf.find(b"\n+++ ", header, end) != -1 or buf.find(b"\nrename to ", header, end) != -1:
+        return end
+    return header
+
+def _diff_header_path(raw_path, strip_prefix=True):
+    """Decodes a path from a diff header, undoing git's C-style quoting and the a/ or b/ prefix."""
+    if raw_path.startswith(b'"') and raw_path.endswith(b'"'):
+        raw_path = codecs.escape_decode(raw_path[1:-1])[0]
+    if strip_prefix:
+        raw_path = raw_path[2:]
+    return raw_path.decode('utf-8', errors='replace')
+
+def _diff_git_line_path(names):
+    """
+    Gets the path from the "a/<path> b/<path>" part of a "diff --git" line. This is only
+    used when old and new paths are the same, so the line splits into two equal halves,
+    which also works for names containing spaces. Returns None if it does not.
+    """
+    half = (len(names) - 1) // 2
+    old_name, new_name = names[:half], names[half + 1:]
+    if names[half:half + 1] != b' ':
+        return None
+    old_path, new_path = _diff_header_path(old_name), _diff_header_path(new_name)
+    return new_path if old_path == new_path else None
+
+def parse_diff_for_changed_files(diff_content, pos=0, endpos=sys.maxsize):
+    """
+    Extracts the paths of the files touched by a raw (bytes) unified diff, in order of appearance.
+    The diff is scanned in a single pass instead of line by line; `pos` and `endpos`
+    restrict the scan to a slice without copying it.
+    Returns a dict mapping each path to whether the file was deleted.
+    Deleted files are reported by their old path, renamed files by their new one.
+    """
+    paths = {}
+    for m in _DIFF_FILE_RE.finditer(diff_content, pos, endpos):
+        names, renamed_to, old_path, new_path = m.groups()
+        # Also catches deleted empty or binary files, which have no ---/+++ lines
+        deleted = b'\ndeleted file mode ' in m.group(0)
+        if renamed_to is not None:
+            paths[_diff_header_path(renamed_to, strip_prefix=False)] = False
+        elif new_path is None:
+            path = _diff_git_line_path(names)
+            if path is not None:
+                paths[path] = deleted
+        elif new_path != b'/dev/null':
+            paths[_diff_header_path(new_path)] = deleted
+        else:
+            paths[_diff_header_path(old_path)] = True
+    return paths
+
+async def list_files(*options):
+    """
+    Lists files with `git ls-files <options>`, which reads Git's index instead of
+    stat()ing the whole working tree. Returns None if git cannot list them.
+    """
+    # Noise directories are excluded even when they are tracked (e.g. a committed node_modules)
+    command = ['git', 'ls-files', *options, '--']
+    command += [f':(exclude,glob)**/{name}/**' for name in sorted(_IGNORE_DIRS)]
+    return await run_command_async(command, none_on_error=True)
+
+def walk_file_tree():
     """
     Generates a pruned file tree of the repository, ignoring common noise.
     """
-    ignore_dirs = ['.git', 'node_modules', '__pycache__', 'dist', 'build']
-    path_list = []
-    for root, dirs, files in os.walk("."):
-        # Prune ignored directories
-        dirs[:] = [d for d in dirs if d not in ignore_dirs]
-        
-        for name in files:
-            path_list.append(os.path.join(root, name))
-    
-    return "\n".join(path_list)
-
-def get_file_content(file_path):
-    """Reads the content of a specified file."""
+    buf = io.StringIO()
+
+    def walk(path):
+        # scandir already knows each entry's type, so no extra stat() per entry
+        try:
+            entries = os.scandir(path)
+        except OSError:
+            # Unreadable directories are skipped, as os.walk does by default
+            return
+        with entries:
+            for entry in entries:
+                if entry.is_dir(follow_symlinks=False):
+                    # Prune ignored directories
+                    if entry.name not in _IGNORE_DIRS:
+                        walk(entry.path)
+                else:
+                    buf.write(entry.path)
+                    buf.write("\n")
+
+    walk(".")
+    return buf.getvalue()
+
+class GitBatch:
+    """
+    A long-running `git cat-file --batch` process for reading blobs over a pipe.
+    Avoids spawning a new git process for every file lookup.
+    """
+
+    def __init__(self):
+        self.proc = None
+
+    def __enter__(self):
+        try:
+            self.proc = subprocess.Popen(
+                ['git', 'cat-file', '--batch'],
+                stdin=subprocess.PIPE,
+                stdout=subprocess.PIPE,
+                stderr=subprocess.DEVNULL,
+                bufsize=0
+            )
+        except FileNotFoundError:
+            self.proc = None
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        if self.proc is not None:
+            self.proc.stdin.close()
+            self.proc.wait()
+            self.proc = None
+
+    def _disable(self):
+        """Stops a broken cat-file process; every later lookup returns None."""
+        proc, self.proc = self.proc, None
+        proc.kill()
+        proc.wait()
+        for pipe in (proc.stdin, proc.stdout):
+            try:
+                pipe.close()
+            except OSError:
+                pass
+
+    def _read_exactly(self, size):
+        chunks = []
+        while size > 0:
+            chunk = self.proc.stdout.read(size)
+            if not chunk:
+                raise EOFError("git cat-file exited unexpectedly")
+            chunks.append(chunk)
+            size -= len(chunk)
+        return b"".join(chunks)
+
+    def _skip(self, size):
+        # Reads past unwanted bytes in fixed-size pieces to keep the pipe in sync
+        while size > 0:
+            chunk = self.proc.stdout.read(min(size, 65536))
+            if not chunk:
+                raise EOFError("git cat-file exited unexpectedly")
+            size -= len(chunk)
+
+    def get_blob(self, sha, path, limit=None):
+        """
+        Returns the raw bytes of `<sha>:<path>`, or None if it is not a blob.
+        An empty sha looks the path up in the index (the staged version).
+        With `limit`, only the first `limit` bytes are kept; the rest is read and discarded.
+        """
+        if self.proc is None or self.proc.poll() is not None:
+            return None
+        # The protocol is line-based, so a newline would turn this into two requests
+        if "\n" in sha or "\n" in path:
+            return None
+        try:
+            self.proc.stdin.write(f"{sha}:{path}\n".encode('utf-8'))
+            # Header is "<sha> <type> <size>", or "<object> missing"/"<object> ambiguous",
+            # where <object> is the request itself and may contain spaces
+            header = self.proc.stdout.readline().rstrip(b"\n")
+            if not header:
+                raise EOFError("git cat-file exited unexpectedly")
+            if header.endswith((b' missing', b' ambiguous')):
+                return None
+            _, object_type, size = header.rsplit(b' ', 2)
+            size = int(size)
+            keep = size if limit is None else min(size, limit)
+            data = self._read_exactly(keep)
+            self._skip(size - keep + 1)  # the rest of the blob and its trailing newline
+        except (EOFError, OSError, ValueError):
+            # git cat-file died (e.g. outside a repository) or the reply was unreadable;
+            # the pipe can't be trusted any more, so callers fall back to open()
+            self._disable()
+            return None
+        return data if object_type == b'blob' else None
+
+def _read_file(file_path, size=-1):
+    """Reads up to `size` characters of a file (all of it by default), or returns a warning message."""
     try:
         with open(file_path, 'r', encoding='utf-8', errors='ignore') as f:
-            return f.read()
+            return f.read(size)
     except FileNotFoundError:
         return f"Warning: File not found: {file_path}"
     except Exception as e:
         return f"Warning: Could not read file {file_path}: {e}"
 
-# --- AI Interaction ---
+def get_file_content(file_path, git_batch=None):
+    """
+    Reads the content of a specified file.
+    If a GitBatch is given, files already in the index are read from it first.
+    """
+    if git_batch is not None:
+        blob = git_batch.get_blob("", file_path)
+        if blob is not None:
+            return blob.decode('utf-8', errors='ignore')
+    return _read_file(file_path)
 
-def get_ai_criticism(prompt: str):
+def get_file_preview(file_path, n=500, git_batch=None, root=""):
     """
-    Sends the provided prompt to the Gemini API and returns the criticism.
+    Reads only the first `n` characters of a file, adding "..." if there is more.
+    If a GitBatch is given, the staged (index) version is read from it first.
+    A path relative to the repository top level is passed with that directory as `root`.
     """
-    if not GEMINI_API_KEY:
-        return """
-        **ERROR: Gemini API Key not found.**
-        Please set the `GEMINI_API_KEY` environment variable.
-        You can get a key from Google AI Studio: https://aistudio.google.com/
-        """
+    data = None
+    if git_batch is not None:
+        # A UTF-8 character is at most 4 bytes, so this is enough for n + 1 characters
+        blob = git_batch.get_blob("", file_path, limit=4 * (n + 1))
+        if blob is not None:
+            data = blob.decode('utf-8', errors='ignore')
+    if data is None:
+        data = _read_file(os.path.join(root, file_path), n + 1)
+    return data[:n] + ("..." if len(data) > n else "")
+
+def get_overview_content(git_batch=None):
+    """Reads the project overview document (README.md, falling back to GEMINI.md)."""
+    return get_file_content("README.md", git_batch) or get_file_content("GEMINI.md", git_batch) or "No overview document found."
+
+def is_previewable(file_path):
+    """Whether a changed file looks like readable source/text worth previewing."""
+    name = os.path.basename(file_path)
+    if name in _SKIPPED_FILES or '.min.' in name:
+        return False
+    return os.path.splitext(name)[1].lower() in _TEXT_EXTS
+
+def get_changed_file_previews(changed_files, git_batch=None, root=""):
+    """
+    Reads the start of each changed text file, in the order of `changed_files`
+    (a dict of path -> deleted, with paths relative to `root`, the repository top level).
+    Deleted files are skipped. With a GitBatch the staged versions are read one after
+    another over its pipe, so the previews match the staged diff rather than the working tree.
+    """
+    previewable = [
+        file_path for file_path, deleted in changed_files.items()
+        if not deleted and is_previewable(file_path)
+    ]
+    if not previewable:
+        if changed_files:
+            return f"All {len(changed_files)} changed file(s) were skipped (deleted, lockfiles, minified or non-text files)."
+        return "No changed files could be identified from the diff."
+    previews = [
+        f"File: {file_path}\n{get_file_preview(file_path, git_batch=git_batch, root=root)}\n"
+        for file_path in previewable
+    ]
+    return "\n".join(previews)
+
+# --- Context Cache ---
+
+async def _context_cache_path():
+    """
+    Returns the cache file for the current repository state, or None if it cannot be keyed.
+    The key changes whenever HEAD moves or the index is written (e.g. by `git add`).
+    """
+    output = await run_command_async(['git', 'rev-parse', 'HEAD', '--absolute-git-dir'], none_on_error=True)
+    if output is None:
+        return None
     try:
-        print("Generating AI criticism... (this may take a moment)")
-        model = genai.GenerativeModel('gemini-1.5-flash')
-        response = model.generate_content(prompt)
-        return response.text
-    except Exception as e:
-        return f"An error occurred while communicating with the Gemini API: {e}"
+        head_sha, git_dir = output.splitlines()
+        index_mtime = os.stat(os.path.join(git_dir, "index")).st_mtime_ns
+    except (ValueError, OSError):
+        return None
+    key = hashlib.sha1(f"{os.getcwd()}\0{head_sha}\0{index_mtime}".encode('utf-8')).hexdigest()
+    return os.path.join(CACHE_DIR, f"{key}.json")
 
-# --- Main Orchestrator ---
+def _read_context_cache(cache_path):
+    """Returns the cached (tracked files, git log) pair, or None on a miss or an expired entry."""
+    try:
+        if time.time() - os.path.getmtime(cache_path) > CACHE_MAX_AGE_SECONDS:
+            return None
+        with open(cache_path, 'r', encoding='utf-8') as f:
+            cached = json.load(f)
+        return cached["tracked_files"], cached["git_log"]
+    except (OSError, ValueError, KeyError, TypeError):
+        return None
 
-def main():
+def _write_context_cache(cache_path, tracked_files, git_log_content):
     """
-    Main function for the AI-powered criticize agent.
+    Atomically writes a cache entry and drops entries (and temp files left behind
+    by interrupted writes) older than CACHE_MAX_AGE_SECONDS.
     """
-    print("--- Running AI Criticism Agent (Phase 1) ---")
+    tmp_path = f"{cache_path}.{os.getpid()}.tmp"
+    try:
+        os.makedirs(CACHE_DIR, exist_ok=True)
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump({"tracked_files": tracked_files, "git_log": git_log_content}, f)
+        os.replace(tmp_path, cache_path)
+        now = time.time()
+        with os.scandir(CACHE_DIR) as entries:
+            for entry in entries:
+                if entry.name.endswith((".json", ".tmp")) and now - entry.stat().st_mtime > CACHE_MAX_AGE_SECONDS:
+                    os.remove(entry.path)
+    except OSError:
+        try:
+            os.remove(tmp_path)
+        except OSError:
+            pass
 
-    # 1. Gather all context
-    print("Gathering project context...")
-    readme_content = get_file_content("README.md") or get_file_content("GEMINI.md") or "No overview document found."
-    git_log_content = get_git_log_subjects()
-    file_tree_content = get_file_tree()
-    staged_diff_content = get_staged_diff_with_context()
+async def get_file_tree_and_log():
+    """
+    Returns (file tree, git log subjects). Tracked files and the log are reused from the
+    on-disk cache while HEAD and the index are unchanged; untracked files are always
+    listed fresh, since creating them does not touch the index.
+    Falls back to walking the filesystem if git cannot list the files.
+    """
+    cache_path, untracked_files = await asyncio.gather(
+        _context_cache_path(),
+        list_files('--others', '--exclude-standard')
+    )
+    cached = None
+    if cache_path is not None:
+        cached = await asyncio.to_thread(_read_context_cache, cache_path)
+    if cached is not None:
+        tracked_files, git_log_content = cached
+    else:
+        tracked_files, git_log_content = await asyncio.gather(list_files('--cached'), get_git_log_subjects())
+        if tracked_files is None:
+            return await asyncio.to_thread(walk_file_tree), git_log_content
+        if cache_path is not None:
+            await asyncio.to_thread(_write_context_cache, cache_path, tracked_files, git_log_content)
+    return tracked_files + (untracked_files or ""), git_log_content
 
-    if "not a git repository" in staged_diff_content:
-        print("Error: This script must be run within a Git repository.", file=sys.stderr)
-        sys.exit(1)
+# --- Prompt Size Limits ---
 
-    if not staged_diff_content.strip() or "Error" in staged_diff_content:
-        print("No staged changes found or error retrieving diff. Add files with 'git add' before running.")
-        return
+def _cap(text, max_chars, head_frac=0.7):
+    """
+    Trims `text` (str or bytes) to at most `max_chars` characters (bytes for bytes),
+    keeping its head and tail around a truncation marker that counts towards the limit.
+    """
+    if len(text) <= max_chars:
+        return text
+    is_bytes = isinstance(text, bytes)
+    unit = "bytes" if is_bytes else "chars"
+    # Size the marker for the worst case first, so the real one can only be shorter
+    kept = max_chars - len(f"\n... [truncated {len(text)} {unit}] ...\n")
+    if kept <= 0:
+        return text[:max_chars]
+    marker = f"\n... [truncated {len(text) - kept} {unit}] ...\n"
+    if is_bytes:
+        marker = marker.encode('utf-8')
+    head = int(kept * head_frac)
+    tail = kept - head
+    return text[:head] + marker + text[len(text) - tail:]
 
-    # 2. Construct the Master Prompt
-    system_prompt = f"""
+# Room left after a file's header for the start of its hunks plus a truncation marker.
+_MIN_DIFF_BODY_BYTES = 256
+
+def _cap_diff(diff_content, max_chars):
+    """
+    Trims a raw (bytes) diff to at most `max_chars` bytes. Files are kept in order as long
+    as their header lines (plus a little of their hunks) fit; the remaining budget is then
+    shared round-robin so one giant file cannot starve the others. Files that do not fit
+    at all are summarised in a single "more files omitted" line.
+    """
+    if len(diff_content) <= max_chars:
+        return diff_content
+    sections = [section for section in _DIFF_SPLIT_RE.split(diff_content) if section]
+    # Everything before the first hunk ("diff --git", "---", "+++", ...) is always kept
+    header_lens = [section.find(b"\n@@") + 1 or len(section) for section in sections]
+    omitted_reserve = len(f"\n... [{len(sections)} more files omitted] ...\n")
+
+    budgets = []
+    remaining = max_chars - omitted_reserve
+    for section, header_len in zip(sections, header_lens):
+        minimum = min(len(section), header_len + _MIN_DIFF_BODY_BYTES)
+        if minimum > remaining:
+            break
+        budgets.append(minimum)
+        remaining -= minimum
+
+    pending = [i for i, budget in enumerate(budgets) if budget < len(sections[i])]
+    # Hand out equal shares; sections smaller than their share leave the rest for the others.
+    while pending and remaining > 0:
+        share = max(remaining // len(pending), 1)
+        still_pending = []
+        for i in pending:
+            grant = min(len(sections[i]) - budgets[i], share, remaining)
+            budgets[i] += grant
+            remaining -= grant
+            if budgets[i] < len(sections[i]):
+                still_pending.append(i)
+        pending = still_pending
+
+    capped = [
+        section[:header_len] + _cap(section[header_len:], budget - header_len)
+        for section, header_len, budget in zip(sections, header_lens, budgets)
+    ]
+    omitted = len(sections) - len(budgets)
+    if omitted:
+        capped.append(f"\n... [{omitted} more files omitted] ...\n".encode('utf-8'))
+    return b"".join(capped)
+
+# --- Prompt Template ---
+
+# The master prompt is kept as fixed segments around the four context sections,
+# so it can be assembled with a single str.join instead of re-rendering a large f-string.
+_PROMPT_HEADER = """
 You are a world-class senior software engineer and code reviewer. Your task is to provide a thorough, constructive, and actionable critique of the code changes provided below. Your analysis must be based on the complete context provided: the project's purpose, its recent history, its file structure, and the specific changes being introduced.
 
 **CRITICAL INSTRUCTIONS:**
@@ -127,16 +561,29 @@ You are a world-class senior software engineer and code reviewer. Your task is t
 
 ---
 **1. Project Overview (from README.md/GEMINI.md):**
-{readme_content}
+"""
+
+_PROMPT_LOG_SECTION = """
 ---
 **2. Recent Commit History (last 15 commits):**
-{git_log_content}
+"""
+
+_PROMPT_TREE_SECTION = """
 ---
 **3. Project File Tree:**
-{file_tree_content}
+"""
+
+_PROMPT_DIFF_SECTION = """
 ---
 **4. Staged Git Diff (with 10 lines of context):**
-{staged_diff_content}
+"""
+
+_PROMPT_FILES_SECTION = """
+---
+**5. Changed Files (first 500 characters of each):**
+"""
+
+_PROMPT_FOOTER = """
 ---
 
 **YOUR TASK:**
@@ -163,16 +610,103 @@ Based on all the context above, provide a detailed code review in the following
     *   **Suggestion:** (How to fix it)
 """
 
-    # 3. Get AI Criticism
-    ai_response = get_ai_criticism(system_prompt)
+def build_prompt(readme_content, git_log_content, file_tree_content, staged_diff_content, changed_files_content):
+    """Assembles the master review prompt from the gathered context."""
+    return "".join((
+        _PROMPT_HEADER, readme_content,
+        _PROMPT_LOG_SECTION, git_log_content,
+        _PROMPT_TREE_SECTION, file_tree_content,
+        _PROMPT_DIFF_SECTION, staged_diff_content,
+        _PROMPT_FILES_SECTION, changed_files_content,
+        _PROMPT_FOOTER,
+    ))
+
+# --- AI Interaction ---
+
+@functools.lru_cache(maxsize=1)
+def _model():
+    """
+    Configures the Gemini SDK and creates the model on first use,
+    so importing this module does no API setup.
+    """
+    genai.configure(api_key=GEMINI_API_KEY)
+    return genai.GenerativeModel('gemini-1.5-flash')
+
+async def get_ai_criticism(prompt: str):
+    """
+    Sends the provided prompt to the Gemini API and yields the criticism as it is generated.
+    """
+    if not GEMINI_API_KEY:
+        yield """
+        **ERROR: Gemini API Key not found.**
+        Please set the `GEMINI_API_KEY` environment variable.
+        You can get a key from Google AI Studio: https://aistudio.google.com/
+        """
+        return
+    try:
+        response = await _model().generate_content_async(prompt, stream=True)
+        async for chunk in response:
+            yield chunk.text
+    except Exception as e:
+        yield f"An error occurred while communicating with the Gemini API: {e}"
+
+# --- Main Orchestrator ---
+
+async def main():
+    """
+    Main function for the AI-powered criticize agent.
+    """
+    print("--- Running AI Criticism Agent (Phase 1) ---")
+
+    # 1. Gather all context
+    print("Gathering project context...")
+    # The git subprocesses and file reads are independent, so run them concurrently.
+    with GitBatch() as git_batch:
+        readme_content, (file_tree_content, git_log_content), (staged_diff_content, changed_files), toplevel = await asyncio.gather(
+            asyncio.to_thread(get_overview_content, git_batch),
+            get_file_tree_and_log(),
+            get_staged_diff_with_context(),
+            run_command_async(['git', 'rev-parse', '--show-toplevel'], none_on_error=True)
+        )
+
+        # The diff comes back as bytes; a str means get_staged_diff_with_context reported an error.
+        diff_error = isinstance(staged_diff_content, str)
+        if diff_error and "not a git repository" in staged_diff_content:
+            print("Error: This script must be run within a Git repository.", file=sys.stderr)
+            sys.exit(1)
+
+        if diff_error or not staged_diff_content.strip():
+            print("No staged changes found or error retrieving diff. Add files with 'git add' before running.")
+            return
+
+        print(f"Reviewing {len(changed_files)} changed file(s): {', '.join(changed_files)}")
+        # Diff paths are relative to the top level, not to the directory the script runs in
+        root = toplevel.rstrip("\n") if toplevel else ""
+        changed_files_content = await asyncio.to_thread(get_changed_file_previews, changed_files, git_batch, root)
+
+    file_tree_content = _cap(file_tree_content, MAX_FILE_TREE_CHARS)
+    changed_files_content = _cap(changed_files_content, MAX_CHANGED_FILES_CHARS)
+    staged_diff_content = _cap_diff(staged_diff_content, MAX_DIFF_CHARS).decode('utf-8', errors='replace')
+
+    # 2. Construct the Master Prompt
+    system_prompt = build_prompt(readme_content, git_log_content, file_tree_content, staged_diff_content, changed_files_content)
 
-    # 4. Print the report
+    # 3. Get AI Criticism and print the report as it streams in
+    print("Generating AI criticism... (this may take a moment)")
     print("\n" + "="*80)
     print("                 AI Code Criticism Report")
     print("="*80 + "\n")
-    print(ai_response)
+    # Flush on line boundaries (or every 32 chunks) rather than once per chunk
+    pending = []
+    async for chunk in get_ai_criticism(system_prompt):
+        pending.append(chunk)
+        if "\n" in chunk or len(pending) >= 32:
+            sys.stdout.write("".join(pending))
+            sys.stdout.flush()
+            pending.clear()
+    sys.stdout.write("".join(pending))
     print("\n" + "="*80)
 
 
 if __name__ == "__main__":
-    main()
+    asyncio.run(main())